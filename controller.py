@@ -4,12 +4,53 @@ from council.llm import LLMMessage, LLMBase
 from council.utils import Option
 from council.controllers import ControllerBase, ExecutionUnit
 
+from llm_cache import LLMResponseCache
+from utils import HistoryFormatter
+
+import heapq
 import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
 from string import Template
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 logger = logging.getLogger("council")
 
+_LINE_RE = re.compile(r"^\s*([^;]+?)\s*;\s*(\d+)\s*;\s*(.*?)\s*$")
+
+_SYSTEM_PROMPT = "You are the Controller module for an AI assistant built to write and revise research articles."
+
+_PLAN_TEMPLATE = Template("""
+        # Task Description
+        Your task is to decide how best to write or revise the ARTICLE. Considering the ARTICLE OUTLINE, ARTICLE, and the CONVERSATION HISTORY,
+        decide whether and how to use the CHAIN described below. You are not responsible for writing any sections,
+        you are only responsible for deciding what to do next. You will delegate work to other agents via the CHAIN.
+
+        # Instructions
+
+        Consider the name and description of the CHAIN and decide whether or how you want to use it.
+        You can decide to invoke the CHAIN multiple times, with different instructions, one invocation per line.
+        Give at most $max_invocations invocations, listed by decreasing score.
+        Provide chain instructions that are relevant towards completing your TASK.
+        If the ARTICLE has fewer than 1500 words, give instructions to expand relevant sections.
+        You will also give each chain invocation a score out of 10, so that their execution can be prioritized.
+        If the CHAIN is not relevant, give it a score of 0.
+
+        ## CHAIN (provided as a name and description)
+        $chain
+
+        ## CONVERSATION HISTORY
+        $conversation_history
+
+        ## ARTICLE OUTLINE
+        $outline
+
+        ## ARTICLE
+        $article
+
+        # Controller Decision formatted precisely as: {chain name};{score out of 10};{instructions on a single line}
+        """)
+
 
 class AppState:
     iteration: int
@@ -36,6 +77,9 @@ class WritingAssistantController(ControllerBase):
         chains: List[Chain],
         response_threshold: float = 0,
         top_k_execution_plan: int = 5,
+        max_history_turns: int = 10,
+        max_article_chars: int = 12000,
+        cache: Optional[LLMResponseCache] = None,
     ):
         """
         Initialize a new instance
@@ -45,122 +89,144 @@ class WritingAssistantController(ControllerBase):
             chains (List[Chain]): the chains to use
             response_threshold (float): a minimum threshold to select a response from its score
             top_k_execution_plan (int): maximum number of execution plan returned
+            max_history_turns (int): maximum number of most recent conversation messages included in prompts
+            max_article_chars (int): maximum number of article characters included in prompts
+            cache (Optional[LLMResponseCache]): an optional cache of LLM responses
         """
         super().__init__(chains)
+        self._chain_by_name = {c.name: c for c in chains}
+        self._chain_details = {c.name: f"name: {c.name}, description: {c.description}" for c in chains}
         self._llm = self.new_monitor("llm", llm)
         self._response_threshold = response_threshold
         self._top_k = top_k_execution_plan
+        self._max_history_turns = max_history_turns
+        self._max_article_chars = max_article_chars
+        self._cache = cache or LLMResponseCache()
+        self._system_message = LLMMessage.system_message(_SYSTEM_PROMPT)
 
         # Controller state variables
         self.state = AppState()
 
+        # Formatted conversation history, extended as new messages come in
+        self._history = HistoryFormatter()
+
     def _execute(self, context: AgentContext) -> List[ExecutionUnit]:
         
         """
         Planning phase.
-        """
 
-        system_prompt = "You are the Controller module for an AI assistant built to write and revise research articles."
-
-        main_prompt_template = Template("""
-        # Task Description
-        Your task is to decide how best to write or revise the ARTICLE. Considering the ARTICLE OUTLINE, ARTICLE, and the CONVERSATION HISTORY,
-        use your available CHAINS to decide what steps to take next. You are not responsible for writing any sections,
-        you are only responsible for deciding what to do next. You will delegate work to other agents via CHAINS.
-
-        # Instructions
-
-        You may delegate work to one or more CHAINS.
-        Consider the name and description of each chain and decide whether or how you want to use it. 
-        Only give instructions to relevant chains.
-        You can decide to invoke the same chain multiple times, with different instructions. 
-        Provide chain instructions that are relevant towards completing your TASK.
-        If the ARTICLE has fewer than 1500 words, give instructions to expand relevant sections.
-        You will also give each chain invocation a score out of 10, so that their execution can be prioritized.
+        Each chain gets its own, smaller planning request. The requests are independent
+        and are sent concurrently, so planning latency is that of the slowest single request.
+        """
 
-        ## CHAINS (provided as a list of chain names and descriptions)
-        $chains
+        # The iteration only advances once a non-empty plan is returned
+        iteration = self.state.iteration + 1
 
-        ## CONVERSATION HISTORY
-        $conversation_history
+        conversation_history = self._conversation_history(context)
 
-        ## ARTICLE OUTLINE
-        $outline
+        with ThreadPoolExecutor(max_workers=len(self.chains)) as executor:
+            futures = [
+                executor.submit(self._plan_chain, context, chain, conversation_history) for chain in self.chains
+            ]
+            responses = [future.result() for future in futures]
 
-        ## ARTICLE
-        $article
+        filtered = []
+        for response in responses:
+            filtered.extend(self._parse_response(response))
 
-        # Controller Decision formatted precisely as: {chain name};{score out of 10};{instructions on a single line}
-        """)
+        if (filtered is None) or (len(filtered) == 0):
+            return []
 
-        # Increment iteration
-        self.state.iteration += 1
+        top = heapq.nlargest(self._top_k, filtered, key=lambda item: item[1])
+
+        # Shared by all execution units: skills must treat it as read-only and copy it before any change.
+        data = {
+            "article": self.state.article,
+            "outline": self.state.outline,
+            "iteration": iteration,
+            "conversation_history": conversation_history,
+        }
+        budget = context.budget
+        result = [
+            ExecutionUnit(
+                chain,
+                budget,
+                initial_state=ChatMessage.chain(message=instruction, data=data),
+                name=f"{chain.name}: {instruction}"
+            )
+            for chain, score, instruction in top
+        ]
 
-        # Get the Chain details
-        chain_details = "\n ".join(
-            [f"name: {c.name}, description: {c.description}" for c in self.chains]
-        )
+        self.state.iteration = iteration
+        return result
 
-        # Get the conversation history
-        conversation_history = [f"{m.kind}: {m.message}" for m in context.chat_history.messages]
+    def _plan_chain(self, context: AgentContext, chain: Chain, conversation_history: str) -> str:
+        """
+        Ask the LLM whether and how to invoke a single chain.
+        """
 
         messages = [
-            LLMMessage.system_message(system_prompt),
+            self._system_message,
             LLMMessage.user_message(
-                main_prompt_template.substitute(
-                    chains=chain_details,
+                _PLAN_TEMPLATE.substitute(
+                    chain=self._chain_details[chain.name],
+                    max_invocations=self._top_k,
                     outline=self.state.outline,
-                    article=self.state.article,
+                    article=_fit(self.state.article, self._max_article_chars),
                     conversation_history=conversation_history,
                 )
             ),
         ]
 
-        llm_result = self._llm.inner.post_chat_request(
-            context=LLMContext.from_context(context, self._llm),
-            messages=messages
-        )
+        # requests run concurrently, each needs its own context to record its own execution log entry
+        llm_context = LLMContext.from_context(context, self._llm)
+        response = self._cache.post_chat_request(self._llm, llm_context, messages)
+        logger.debug("controller response for %s: %s", chain.name, response)
+        return response
 
-        response = llm_result.first_choice
-        logger.debug(f"controller response: {response}")
-
-        parsed = response.splitlines()
-        parsed = [p for p in parsed if len(p) > 0]
-        parsed = [self.parse_line(line) for line in parsed]
-
-        filtered = [
-            r.unwrap()
-            for r in parsed
-            if r.is_some() and r.unwrap()[1] > self._response_threshold
-        ]
-        if (filtered is None) or (len(filtered) == 0):
-            return []
+    def _conversation_history(self, context: AgentContext) -> str:
+        """
+        Format the most recent turns of the conversation history, one message per line.
 
-        filtered.sort(key=lambda item: item[1], reverse=True)
+        The chat history only grows, so only messages added since the previous call are formatted.
+        """
+        return self._history.format(list(context.chat_history.messages), self._max_history_turns)
 
+    def _parse_response(self, response: str) -> List[Tuple[Chain, int, str]]:
+        """
+        Parse the invocations of one planning response, keeping those above the response threshold.
+        """
         result = []
-        for chain, score, instruction in filtered: 
-            initial_state = ChatMessage.chain(
-                message=instruction, data={"article": self.state.article, "outline": self.state.outline, "iteration": self.state.iteration}
-            )
-            exec_unit = ExecutionUnit(
-                chain,
-                context.budget,
-                initial_state=initial_state,
-                name=f"{chain.name}: {instruction}"
-            )
-            result.append(exec_unit)
-
-        result = result[: self._top_k]
+        for line in response.splitlines():
+            if len(line) == 0:
+                continue
+            parsed = self.parse_line(line)
+            if parsed.is_some() and parsed.unwrap()[1] > self._response_threshold:
+                result.append(parsed.unwrap())
         return result
 
     def parse_line(self, line: str) -> Option[Tuple[Chain, int, str]]:
         result: Option[Tuple[Chain, int, str]] = Option.none()
         try:
-            (name, score, instruction) = line.split(";")[:3]
-            chain = next(filter(lambda item: item.name == name, self.chains))
+            match = _LINE_RE.match(line)
+            if match is None:
+                raise ValueError("expected {chain name};{score};{instructions}")
+            (name, score, instruction) = match.groups()
+            chain = self._chain_by_name[name]
             result = Option.some((chain, int(score), instruction))
         except Exception as e:
             logger.error(f"Controller parsing error: {e}.\n{line}")
         finally:
             return result
+
+
+def _fit(text: str, max_chars: int) -> str:
+    """
+    Keep the head and the tail of a text longer than `max_chars` characters.
+    """
+    if len(text) <= max_chars:
+        return text
+    if max_chars < 2:
+        # too short for both a head and a tail
+        return text[: max(max_chars, 0)]
+    return text[: max_chars // 2] + "\n...[truncated]...\n" + text[-(max_chars // 2):]
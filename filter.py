@@ -1,21 +1,106 @@
+import hashlib
 import logging
+import re
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from string import Template
-from typing import List
+from typing import Dict, List, Optional, Set, Tuple
 
 from council.contexts import AgentContext, ChatMessage, ChatMessageKind, LLMContext, ScoredChatMessage
 from council.filters import FilterBase
 from council.llm import LLMBase, LLMMessage
 
 from controller import AppState
+from llm_cache import LLMResponseCache
+from utils import format_history, write_atomically
 
 logger = logging.getLogger("council")
 
+_HEADER_RE = re.compile(r"^(#{1,3})\s+(.+?)\s*$", re.M)
+# Everything the CHECK LIST looks for in an article, found in a single pass. Header titles are
+# captured in a lookahead, so that placeholders within headers are still found.
+_MARKERS = re.compile(
+    r"(?P<placeholder>(?i:\[(?:insert|add|placeholder|todo|tbd)\b[^\]]*\]|\bTODO\b|\bTBD\b))"
+    r"|(?P<header>^(?P<level>#{1,3})[ \t]+(?=(?P<title>[^\n]+?)[ \t]*$))"
+    r"|(?P<blank>\n\s*\n)",
+    re.M,
+)
+
+_SYSTEM_PROMPT = (
+    "You are an expert-level AI writing editor. You will perform up to three editorial tasks; "
+    "return sections delimited by <<<DECISION>>>...<<<END_DECISION>>>, <<<OUTLINE>>>...<<<END_OUTLINE>>>, "
+    "<<<ARTICLE>>>...<<<END_ARTICLE>>>, in this order."
+)
+
+_AGGREGATION_TEMPLATE = Template("""
+        # Task Description
+        Your task is to complete the EDITORIAL TASKS below, in order. Each task must be answered in its own delimited section.
+
+        # EDITORIAL TASKS
+        $tasks
+
+        # CHECK LIST
+        - If the ARTICLE still has placeholders or empty sections, KEEP EDITING.
+        - If the ARTICLE is incoherent, KEEP EDITING.
+        - If there are ARTICLE subsections with fewer than three paragraphs, KEEP EDITING.
+        - If the ARTICLE does not include everything being requested in the CHAT HISTORY, KEEP EDITING.
+        - If the ARTICLE does not include every section and subsection in ARTICLE OUTLINE, KEEP EDITING.
+        - WORD COUNT: What is the ARTICLE's word count?
+        - If the WORD COUNT is less than 1500 words, KEEP EDITING.
+        - SECTIONS and SUBSECTIONS: Does the ARTICLE contain every section and subsection in the ARTICLE OUTLINE?
+        - If the ARTICLE is missing SECTIONS or SUBSECTIONS from the ARTICLE OUTLINE, KEEP EDITING.
+        - If the ARTICLE has any sections or subsections with fewer than three detailed paragraphs, KEEP EDITING.
+
+        ## CONVERSATION HISTORY
+        $conversation_history
+
+        ## EXISTING OUTLINE
+        $existing_outline
+        $possible_outlines
+        ## EXISTING ARTICLE
+        <article>
+        $existing_article
+        </article>
+        $partial_articles
+        # Your Response
+        """)
+
 
 class WritingAssistantFilter(FilterBase):
-    def __init__(self, llm: LLMBase, state: AppState):
+    def __init__(
+        self,
+        llm: LLMBase,
+        state: AppState,
+        max_history_turns: int = 10,
+        cache: Optional[LLMResponseCache] = None,
+        checkpoint_path: Optional[str] = None,
+        max_local_decisions: int = 3,
+    ):
+        """
+        Initialize a new instance
+
+        Parameters:
+            llm (LLMBase): the instance of LLM to use
+            state (AppState): the state shared with the controller
+            max_history_turns (int): maximum number of most recent conversation messages included in prompts
+            cache (Optional[LLMResponseCache]): an optional cache of LLM responses
+            checkpoint_path (Optional[str]): an optional file the article is saved to after every iteration
+            max_local_decisions (int): maximum number of consecutive keep-editing decisions taken from the local
+                CHECK LIST without asking the LLM
+        """
         super().__init__()
         self.state = state
+        self._max_history_turns = max_history_turns
+        self._cache = cache or LLMResponseCache()
         self._llm = self.new_monitor("llm", llm)
+        self._system_message = LLMMessage.system_message(_SYSTEM_PROMPT)
+        self._last_decision_key: Optional[bytes] = None
+        self._last_decision: Optional[str] = None
+        self._max_local_decisions = max_local_decisions
+        self._local_decisions = 0
+        self._checkpoint_path = checkpoint_path
+        # a single background writer keeps checkpoints in order, off the agent loop
+        self._checkpoint_writer = ThreadPoolExecutor(max_workers=1) if checkpoint_path is not None else None
 
     def _execute(self, context: AgentContext) -> List[ScoredChatMessage]:
 
@@ -25,176 +110,401 @@ class WritingAssistantFilter(FilterBase):
         Get latest iteration results from Evaluator and aggregate if applicable.
         """
 
-        all_eval_results = sorted(context.evaluation, key=lambda x: x.score, reverse=True)
-        current_iteration_results = []
-        for scored_result in all_eval_results:
-            message = scored_result.message
-            if message.data['iteration'] == self.state.iteration:
-                current_iteration_results.append(message)
+        current_iteration_results = [
+            scored_result
+            for scored_result in context.evaluation
+            if scored_result.message.data['iteration'] == self.state.iteration
+        ]
+        # highest scores first, so that deduplication keeps the best of equivalent results
+        current_iteration_results.sort(key=lambda x: x.score, reverse=True)
+
+        if len(current_iteration_results) == 0:
+            return []
 
         ## If multiple outlines or articles were generated in the last iteration,
         ## use LLM calls to aggregate them.
 
         outlines = []
         articles = []
-        conversation_history = [f"{m.kind}: {m.message}" for m in context.chat_history.messages]
+        messages = list(context.chat_history.messages)
+        # not a negative slice: [-0:] would keep every message
+        conversation_history = format_history(messages[max(len(messages) - self._max_history_turns, 0):])
 
-        for message in current_iteration_results:
+        for scored_result in current_iteration_results:
+            message = scored_result.message
             source = message.source
             if source == "SectionWriterSkill":
                 articles.append(message.data['article'])
             elif source == "OutlineWriterSkill":
                 outlines.append(message.data['outline'])
 
-        ### Outline Aggregation
-
-        system_prompt = "You are an expert-level AI writing editor. Your role is to aggregate multiple suggestions for an article outline into a single one."
-        main_prompt_template = Template("""
-        # Task Description
-        Your task is to combine one or more article outlines into a single one written in markdown format.
-
-        # Instructions
-        Read the CHAT HISTORY, EXISTING OUTLINE, and POSSIBLE OUTLINES. Then respond with a single article outline that best combines the POSSIBLE OUTLINES.
-
-        ## CONVERSATION HISTORY
-        $conversation_history
-
-        ## EXISTING OUTLINE
-        $existing_outline
-
-        ## POSSIBLE OUTLINES
-        $possible_outlines
-
-        ## OUTLINE
-        ```markdown
-        """)
-
-        if len(outlines) > 0:
-            messages = [
-                LLMMessage.system_message(system_prompt),
-                LLMMessage.user_message(
-                    main_prompt_template.substitute(
-                        conversation_history=conversation_history,
-                        existing_outline=self.state.outline,
-                        possible_outlines=outlines
-                    )
-                ),
-            ]
-            llm_result = self._llm.inner.post_chat_request(
-                LLMContext.from_context(context, self._llm),
-                messages=messages
-            )
-            response = llm_result.first_choice
-            self.state.outline = response
-
-        ### Article Aggregation
+        ## Drop duplicated outlines and articles, e.g. when several writers made the same edit.
+
+        outlines = _deduplicate(outlines, self.state.outline)
+        articles = _deduplicate(articles, self.state.article)
+
+        ## A single outline or article needs no aggregation, use it as is.
+
+        if len(outlines) == 1:
+            self.state.outline = _strip_code_fence(outlines.pop())
+        if len(articles) == 1:
+            self.state.article = _strip_code_fence(articles.pop())
+
+        ## When there is nothing to aggregate, the LLM is only needed for the keep-editing decision.
+        ## Skip it when the local CHECK LIST already says to keep editing, or when the article,
+        ## the outline and the conversation history did not change since the last decision.
+        ## The local CHECK LIST only ever saves an LLM call: it is a heuristic, so it never overrules
+        ## the LLM decision, and the LLM is asked again after `max_local_decisions` skipped calls.
+
+        nothing_to_aggregate = len(outlines) == 0 and len(articles) == 0
+        if (
+            nothing_to_aggregate
+            and self._local_decisions < self._max_local_decisions
+            and _fails_check_list(self.state.article, self.state.outline)
+        ):
+            decision = "KEEP EDITING"
+            self._local_decisions += 1
+        elif nothing_to_aggregate and self._decision_key(conversation_history) == self._last_decision_key:
+            decision = self._last_decision
+        else:
+            decision = self._aggregate(context, outlines, articles, conversation_history)
+            self._local_decisions = 0
+            self._last_decision_key = self._decision_key(conversation_history)
+            self._last_decision = decision
 
-        system_prompt = "You are an expert-level AI writing editor. Your role is to aggregate multiple partial articles into a single, complete article."
-        main_prompt_template = Template("""
-        # Task Description
-        Your task is to combine one or more partial articles into a single one written in markdown format.
+        logger.debug("outline: %s", self.state.outline)
+        logger.debug("article: %s", self.state.article)
+        logger.debug("controller editing decision: %s", decision)
 
-        # Instructions
-        Read the CHAT HISTORY, ARTICLE OUTLINE, EXISTING ARTICLE, and PARTIAL ARTICLES. 
-        Then respond with a single article that best combines and expands the PARTIAL ARTICLES.
-        The resulting ARTICLE should include all sections and subsections in the ARTICLE OUTLINE.
+        self._checkpoint()
 
-        ## CONVERSATION HISTORY
-        $conversation_history
+        if decision is None or "KEEP EDITING" in decision:
+            return []
+        else:
+            return [ScoredChatMessage(ChatMessage(message=self.state.article, kind=ChatMessageKind.Agent), 1.0)]
 
-        ## ARTICLE OUTLINE
-        $article_outline
+    def _aggregate(
+        self, context: AgentContext, outlines: List[str], articles: List[str], conversation_history: str
+    ) -> Optional[str]:
+        """
+        Aggregate outlines and articles into the state and return the keep-editing decision, if any.
+        """
 
-        ## EXISTING ARTICLE
-        $existing_article
+        ### Outline aggregation, article aggregation and the keep-editing decision
+        ### are batched into a single LLM call. Each sub-task answers in its own
+        ### delimited section of the response. The short decision comes first, so that
+        ### it survives a response truncated by the output token limit.
 
-        ## PARTIAL ARTICLES
-        $partial_articles
-
-        ## ARTICLE
-        ```markdown
-        """)
+        ## Content of the PARTIAL ARTICLES that is unchanged from the EXISTING ARTICLE is replaced
+        ## by a reference to the matching chunk of the EXISTING ARTICLE, instead of being sent again.
 
+        existing_article = self.state.article
+        chunks = {}
         if len(articles) > 0:
-            messages = [
-                LLMMessage.system_message(system_prompt),
-                LLMMessage.user_message(
-                    main_prompt_template.substitute(
-                        conversation_history=conversation_history,
-                        article_outline=self.state.outline,
-                        existing_article=self.state.article,
-                        partial_articles=articles
-                    )
-                ),
-            ]
-            llm_result = self._llm.inner.post_chat_request(
-                context=LLMContext.from_context(context, self._llm),
-                messages=messages)
-            self.state.article = llm_result.first_choice
-
-        ### Decide whether to keep iterating or to return the article
-        ### to the user for review.
-
-        system_prompt = "You are an expert-level AI writing editor. Your role is to decide whether to keep editing the ARTICLE."
-        main_prompt_template = Template("""
-        # Task Description
-        Your task is to decide whether:
-        1. To keep editing the ARTICLE, or
-        2. To return the article to the requesting agent.
-
-        You will use a CHECK LIST to determine whether to KEEP EDITING.
-
-        # Instructions
-        Consider every item in the CHECK LIST.
-        If any item is true, KEEP EDITING.
-        You must be careful and accurate when completing the CHECK LIST.                    
-
-        # CHECK LIST
-        - If the ARTICLE still has placeholders or empty sections, KEEP EDITING.
-        - If the ARTICLE is incoherent, KEEP EDITING.
-        - If there are ARTICLE subsections with fewer than three paragraphs, KEEP EDITING.
-        - If the ARTICLE does not include everything being requested in the CHAT HISTORY, KEEP EDITING.
-        - If the ARTICLE does not include every section and subsection in ARTICLE OUTLINE, KEEP EDITING.
-        - WORD COUNT: What is the ARTICLE's word count?
-        - If the WORD COUNT is less than 1500 words, KEEP EDITING.
-        - SECTIONS and SUBSECTIONS: Does the ARTICLE contain every section and subsection in the ARTICLE OUTLINE?
-        - If the ARTICLE is missing SECTIONS or SUBSECTIONS from the ARTICLE OUTLINE, KEEP EDITING.
-        - If the ARTICLE has any sections or subsections with fewer than three detailed paragraphs, KEEP EDITING.
+            chunks = {key: text for key, text in _split_cdc(self.state.article) if text.strip()}
+            existing_article = _mark_chunks(self.state.article)
+            articles = [_reference_chunks(article, chunks) for article in articles]
 
-        ## ARTICLE OUTLINE
-        $outline
+        ## New paragraphs repeated across the PARTIAL ARTICLES are sent once, later copies are
+        ## replaced by a reference to their first occurrence.
 
-        ## ARTICLE
-        <article>
-        $article
-        </article>
+        articles, paragraphs = _reference_paragraphs(articles)
 
-        ## CONVERSATION HISTORY
-        $conversation_history
-
-        # Your Response (a list of all CHECK LIST results followed by exactly one of ["KEEP EDITING", "RETURN TO REQUESTING AGENT"])
-        """)
+        tasks = [
+            "- DECISION: Decide whether to KEEP EDITING the ARTICLE or to return it to the requesting agent. "
+            "Consider every item in the CHECK LIST. If any item is true, KEEP EDITING. "
+            "You must be careful and accurate when completing the CHECK LIST. "
+            "Between <<<DECISION>>> and <<<END_DECISION>>>, write a list of all CHECK LIST results "
+            'followed by exactly one of ["KEEP EDITING", "RETURN TO REQUESTING AGENT"].'
+        ]
+        if len(outlines) > 0:
+            tasks.append(
+                "- OUTLINE: Read the CHAT HISTORY, EXISTING OUTLINE, and POSSIBLE OUTLINES. Then write a single article outline "
+                "in markdown format that best combines the POSSIBLE OUTLINES, between <<<OUTLINE>>> and <<<END_OUTLINE>>>."
+            )
+        if len(articles) > 0:
+            tasks.append(
+                "- ARTICLE: Read the CHAT HISTORY, ARTICLE OUTLINE, EXISTING ARTICLE, and PARTIAL ARTICLES. "
+                "Then write a single article in markdown format that best combines and expands the PARTIAL ARTICLES, "
+                "between <<<ARTICLE>>> and <<<END_ARTICLE>>>. "
+                "The resulting ARTICLE should include all sections and subsections in the ARTICLE OUTLINE. "
+                "In the PARTIAL ARTICLES, [UNCHANGED CHUNK #id] stands for the chunk of the EXISTING ARTICLE "
+                "marked <!-- chunk #id -->, and [SEE PARAGRAPH #id ABOVE] stands for the paragraph marked "
+                "<!-- paragraph #id --> in an earlier PARTIAL ARTICLE: always write such chunks and paragraphs out in full."
+            )
+        tasks.append(
+            "The ARTICLE OUTLINE is the outline you write in the OUTLINE task, or the EXISTING OUTLINE if there is no OUTLINE task. "
+            "The ARTICLE is the article you write in the ARTICLE task, or the EXISTING ARTICLE if there is no ARTICLE task."
+        )
 
         messages = [
-            LLMMessage.system_message(system_prompt),
+            self._system_message,
             LLMMessage.user_message(
-                main_prompt_template.substitute(
-                    article=self.state.article,
-                    outline=self.state.outline,
+                _AGGREGATION_TEMPLATE.substitute(
+                    tasks="\n        ".join(tasks),
                     conversation_history=conversation_history,
+                    existing_outline=self.state.outline,
+                    possible_outlines=_optional_section("POSSIBLE OUTLINES", outlines),
+                    existing_article=existing_article,
+                    partial_articles=_optional_section("PARTIAL ARTICLES", articles),
                 )
             ),
         ]
 
-        llm_result = self._llm.inner.post_chat_request(
-            context=LLMContext.from_context(context, self._llm),
-            messages=messages)
-        response = llm_result.first_choice
-        logger.debug(f"outline: {self.state.outline}")
-        logger.debug(f"article: {self.state.article}")
-        logger.debug(f"controller editing decision: {response}")
+        response = self._cache.post_chat_request(self._llm, LLMContext.from_context(context, self._llm), messages)
 
-        if "KEEP EDITING" in response:
-            return []
+        complete = True
+        if len(outlines) > 0:
+            outline = _extract_section(response, "OUTLINE")
+            if outline:
+                self.state.outline = outline
+            else:
+                complete = False
+        if len(articles) > 0:
+            article = _extract_section(response, "ARTICLE")
+            if article:
+                self.state.article = _expand_chunks(_expand_paragraphs(article, paragraphs), chunks)
+            else:
+                complete = False
+
+        decision = _extract_section(response, "DECISION")
+        if (decision is None or not complete) and (len(outlines) > 0 or len(articles) > 0):
+            # the response was cut short: the decision is missing, or is about an outline or an article
+            # that was not written out, so decide on the state as it is with a separate request
+            return self._aggregate(context, [], [], conversation_history)
+        return decision
+
+    def _checkpoint(self) -> None:
+        """
+        Save the article to the checkpoint file, if any, in the background.
+        """
+        if self._checkpoint_writer is None:
+            return
+        self._checkpoint_writer.submit(_write_file, self._checkpoint_path, self.state.article)
+
+    def _decision_key(self, conversation_history: str) -> bytes:
+        """
+        Content hash of the inputs of the keep-editing decision.
+        """
+        content = "\x1f".join([self.state.article, self.state.outline, conversation_history])
+        return hashlib.blake2b(content.encode(), digest_size=16).digest()
+
+
+def _write_file(path: str, text: str) -> None:
+    try:
+        write_atomically(path, text)
+    except OSError as e:
+        logger.warning("checkpoint to %s failed: %s", path, e)
+
+
+def _fails_check_list(article: str, outline: str) -> bool:
+    """
+    Evaluate the deterministic items of the keep-editing CHECK LIST.
+
+    Returns True when the article certainly needs more editing: too short, with placeholders,
+    missing outline headers, or with a section of fewer than three paragraphs.
+    Judgments such as coherence are left to the LLM.
+    """
+    if len(article.split()) < 1500:
+        return True
+
+    # a single scan of the article tallies the headers and the paragraphs of every section:
+    # every block of text between blank lines is a paragraph, except for a leading header line
+    text = article + "\n\n"
+    headers = []
+    sections = []
+    block_start = 0
+    for match in _MARKERS.finditer(text):
+        kind = match.lastgroup
+        if kind == "placeholder":
+            return True
+        if kind == "header":
+            headers.append(match.group("title"))
+            if text[block_start:match.start()].strip() == "":
+                sections.append([len(match.group("level")), 0])
+                # text right below the header line is the first paragraph of the section
+                block_start = text.index("\n", match.start())
         else:
-            return [ScoredChatMessage(ChatMessage(message=self.state.article, kind=ChatMessageKind.Agent), 1.0)]
+            if text[block_start:match.start()].strip() and len(sections) > 0:
+                sections[-1][1] += 1
+            block_start = match.end()
+
+    normalized_headers = "\n".join(_normalize(header) for header in headers)
+    if any(_normalize(header) not in normalized_headers for _, header in _HEADER_RE.findall(outline)):
+        return True
+
+    # sections without subsections need three paragraphs
+    for (level, paragraphs), following in zip(sections, sections[1:] + [[0, 0]]):
+        if following[0] <= level and paragraphs < 3:
+            return True
+
+    return False
+
+
+def _normalize(text: str) -> str:
+    """
+    Lower case words of `text`, without punctuation nor a leading section number such as "1." or "2.3".
+    """
+    text = re.sub(r"^\s*\d+(?:\.\d+)*[.)]?(?=\s)", "", text)
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text.lower()).split())
+
+
+def _optional_section(title: str, items: List[str]) -> str:
+    """
+    Prompt section listing `items` separated by horizontal rules, or nothing when there are none.
+    """
+    if len(items) == 0:
+        return ""
+    return f"\n## {title}\n" + "\n\n---\n\n".join(items) + "\n"
+
+
+def _deduplicate(texts: List[str], reference: str, threshold: float = 0.9) -> List[str]:
+    """
+    Remove exact and near duplicates from `texts`, preserving order.
+
+    Near duplicates are detected on what each text changes with respect to `reference`
+    (the existing outline or article): texts whose new shingles overlap by more than
+    `threshold` (Jaccard similarity) made the same edit, and only the first one is kept.
+    A text without new shingles, e.g. one that only removes content, or whose new shingles
+    include all those of a kept text and more, is never a near duplicate.
+    """
+    reference_shingles = _shingles(reference)
+    result = []
+    kept_changes = []
+    for text in dict.fromkeys(texts):
+        changes = _shingles(text) - reference_shingles
+        if any(_is_same_edit(changes, kept, threshold) for kept in kept_changes):
+            continue
+        result.append(text)
+        kept_changes.append(changes)
+    return result
+
+
+def _is_same_edit(changes: Set[int], kept: Set[int], threshold: float) -> bool:
+    if len(changes) == 0 or len(kept) == 0 or changes > kept:
+        return False
+    return _jaccard(changes, kept) > threshold
+
+
+def _shingles(text: str, size: int = 8) -> Set[int]:
+    """
+    Hashes of the overlapping runs of `size` words in `text`.
+    """
+    words = text.split()
+    return {hash(" ".join(words[i:i + size])) for i in range(max(len(words) - size, 0) + 1)}
+
+
+def _jaccard(a: Set[int], b: Set[int]) -> float:
+    if len(a) == 0 and len(b) == 0:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _split_cdc(text: str, m: int = 8) -> List[Tuple[str, str]]:
+    """
+    Split `text` into content-defined chunks, returned as (hash, chunk) pairs.
+
+    A chunk ends after every line whose checksum is a multiple of `m` (which includes blank lines),
+    so chunk boundaries depend on the content only and an edit does not shift the chunks around it.
+    """
+    result = []
+    lines = []
+    for line in text.split("\n"):
+        lines.append(line)
+        if zlib.crc32(line.encode()) % m == 0:
+            result.append("\n".join(lines))
+            lines = []
+    if len(lines) > 0:
+        result.append("\n".join(lines))
+    return [(hashlib.blake2b(chunk.encode(), digest_size=4).hexdigest(), chunk) for chunk in result]
+
+
+def _mark_chunks(text: str) -> str:
+    """
+    Precede every non-blank chunk of `text` with a <!-- chunk #hash --> marker.
+    """
+    return "\n".join(f"<!-- chunk #{key} -->\n{chunk}" if chunk.strip() else chunk for key, chunk in _split_cdc(text))
+
+
+def _reference_chunks(text: str, chunks: Dict[str, str]) -> str:
+    """
+    Replace every chunk of `text` found in `chunks` with an [UNCHANGED CHUNK #hash] reference.
+    """
+    return "\n".join(f"[UNCHANGED CHUNK #{key}]" if key in chunks else chunk for key, chunk in _split_cdc(text))
+
+
+def _expand_chunks(text: str, chunks: Dict[str, str]) -> str:
+    """
+    Remove chunk markers from `text` and expand any chunk reference the LLM copied instead of the chunk itself.
+    """
+    text = re.sub(r"<!-- chunk #[0-9a-f]+ -->\n?", "", text)
+    return re.sub(
+        r"\[UNCHANGED CHUNK #([0-9a-f]+)\]",
+        lambda match: chunks.get(match.group(1), ""),
+        text,
+    )
+
+
+def _reference_paragraphs(texts: List[str], min_chars: int = 80) -> Tuple[List[str], Dict[str, str]]:
+    """
+    Replace every repeated paragraph of `texts` with a [SEE PARAGRAPH #hash ABOVE] reference.
+
+    The first occurrence of a repeated paragraph is preceded by a <!-- paragraph #hash --> marker.
+    Paragraphs shorter than `min_chars`, such as headers, are cheaper to repeat than to reference.
+    Returns the texts and the referenced paragraphs by hash.
+    """
+    blocks = [text.split("\n\n") for text in texts]
+    counts: Dict[str, int] = {}
+    for paragraph in (p for paragraphs in blocks for p in paragraphs if len(p.strip()) >= min_chars):
+        key = hashlib.blake2b(paragraph.encode(), digest_size=8).hexdigest()
+        counts[key] = counts.get(key, 0) + 1
+
+    referenced: Dict[str, str] = {}
+    result = []
+    for paragraphs in blocks:
+        for i, paragraph in enumerate(paragraphs):
+            if len(paragraph.strip()) < min_chars:
+                continue
+            key = hashlib.blake2b(paragraph.encode(), digest_size=8).hexdigest()
+            if key in referenced:
+                paragraphs[i] = f"[SEE PARAGRAPH #{key} ABOVE]"
+            elif counts[key] > 1:
+                referenced[key] = paragraph
+                paragraphs[i] = f"<!-- paragraph #{key} -->\n{paragraph}"
+        result.append("\n\n".join(paragraphs))
+    return result, referenced
+
+
+def _expand_paragraphs(text: str, paragraphs: Dict[str, str]) -> str:
+    """
+    Remove paragraph markers from `text` and expand any paragraph reference the LLM copied instead of the paragraph.
+    """
+    text = re.sub(r"<!-- paragraph #[0-9a-f]+ -->\n?", "", text)
+    return re.sub(
+        r"\[SEE PARAGRAPH #([0-9a-f]+) ABOVE\]",
+        lambda match: paragraphs.get(match.group(1), ""),
+        text,
+    )
+
+
+def _extract_section(response: str, name: str) -> Optional[str]:
+    """
+    Extract the content delimited by <<<NAME>>> and <<<END_NAME>>> from a batched LLM response.
+    Returns None when the section is missing, e.g. when the response was truncated.
+    """
+    match = re.search(rf"<<<{name}>>>(.*?)<<<END_{name}>>>", response, re.S)
+    if match is None:
+        logger.warning("section %s missing from aggregation response", name)
+        return None
+
+    return _strip_code_fence(match.group(1))
+
+
+def _strip_code_fence(text: str) -> str:
+    """
+    Remove the markdown code fence an LLM may wrap (or, when primed with an opening fence, end) its answer with.
+    """
+    text = text.strip()
+    text = re.sub(r"^```[a-z]*\n", "", text)
+    text = re.sub(r"\n?```$", "", text)
+    return text.strip()
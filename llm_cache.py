@@ -0,0 +1,105 @@
+from council.contexts import LLMContext, Monitored
+from council.llm import LLMBase, LLMMessage
+
+from utils import write_atomically
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger("council")
+
+
+class LLMResponseCache:
+    """
+    A content-addressed cache of LLM responses, keyed by a hash of the full request.
+
+    The most recent responses are kept in memory, and are also persisted as one file per request
+    when a `directory` is given. Only deterministic requests (temperature 0) are cached, so that
+    caching never changes the sampling behaviour.
+    """
+
+    def __init__(self, directory: Optional[str] = None, maxsize: int = 256):
+        """
+        Initialize a new instance
+
+        Parameters:
+            directory (Optional[str]): an optional directory responses are persisted to
+            maxsize (int): maximum number of responses kept in memory
+        """
+        self._directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self._maxsize = maxsize
+        self._memory: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def post_chat_request(
+        self, llm: Monitored[LLMBase], context: LLMContext, messages: List[LLMMessage], **kwargs: Any
+    ) -> str:
+        """
+        Return the first choice of the LLM response to `messages`, from the cache when possible.
+        """
+        payload = self._payload(llm.inner, messages, kwargs)
+        if payload.get("temperature", 0) > 0:
+            return llm.inner.post_chat_request(context=context, messages=messages, **kwargs).first_choice
+
+        key = hashlib.blake2b(json.dumps(payload, sort_keys=True).encode(), digest_size=16).hexdigest()
+        response = self._get(key)
+        if response is not None:
+            logger.debug("llm cache hit: %s", key)
+            return response
+
+        response = llm.inner.post_chat_request(context=context, messages=messages, **kwargs).first_choice
+        self._set(key, response)
+        return response
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+        if self._directory is None:
+            return None
+        path = os.path.join(self._directory, key)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            response = f.read()
+        self._remember(key, response)
+        return response
+
+    def _set(self, key: str, response: str) -> None:
+        self._remember(key, response)
+        if self._directory is None:
+            return
+
+        # a response that can not be persisted is still cached in memory
+        path = os.path.join(self._directory, key)
+        try:
+            write_atomically(path, response)
+        except OSError as e:
+            logger.warning("llm cache write to %s failed: %s", path, e)
+
+    def _remember(self, key: str, response: str) -> None:
+        with self._lock:
+            self._memory[key] = response
+            self._memory.move_to_end(key)
+            if len(self._memory) > self._maxsize:
+                self._memory.popitem(last=False)
+
+    @staticmethod
+    def _payload(llm: LLMBase, messages: List[LLMMessage], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Everything that determines the response: the LLM configuration, the request arguments and the messages.
+        """
+        config = getattr(llm, "config", None)
+        payload = config.build_default_payload() if config is not None else {}
+        payload.update(kwargs)
+        payload["messages"] = [message.dict() for message in messages]
+        return payload
@@ -0,0 +1,57 @@
+from council.llm import OpenAIChatCompletionsModel, OpenAILLMConfiguration, OpenAITokenCounter
+
+import httpx
+import importlib.util
+from typing import Any, Optional
+
+
+class PooledOpenAIChatCompletionsModelProvider:
+    """
+    Posts OpenAI chat completion requests through a single, long-lived `httpx.Client`,
+    so that connections (and their TLS handshakes) are reused across requests.
+    """
+
+    config: OpenAILLMConfiguration
+
+    def __init__(self, config: OpenAILLMConfiguration, client: httpx.Client):
+        self.config = config
+        self._client = client
+
+    def post_request(self, payload: dict[str, Any]) -> httpx.Response:
+        uri = "https://api.openai.com/v1/chat/completions"
+        headers = {"Authorization": self.config.authorization, "Content-Type": "application/json"}
+        return self._client.post(url=uri, headers=headers, json=payload)
+
+
+class PooledOpenAILLM(OpenAIChatCompletionsModel):
+    """
+    An OpenAI LLM, like `council.llm.OpenAILLM`, that keeps its HTTP connections alive between requests.
+
+    The client is safe to share between threads, e.g. the controller's concurrent planning requests.
+    """
+
+    config: OpenAILLMConfiguration
+
+    def __init__(self, config: OpenAILLMConfiguration, client: Optional[httpx.Client] = None):
+        """
+        Initialize a new instance
+
+        Parameters:
+            config (OpenAILLMConfiguration): the LLM configuration
+            client (Optional[httpx.Client]): the HTTP client to use, a pooled one is created if not provided
+        """
+        client = client or httpx.Client(
+            timeout=httpx.Timeout(5.0, read=config.timeout),
+            limits=httpx.Limits(max_keepalive_connections=16, max_connections=32),
+            # HTTP/2 requires the optional h2 package
+            http2=importlib.util.find_spec("h2") is not None,
+        )
+        super().__init__(
+            config,
+            PooledOpenAIChatCompletionsModelProvider(config, client).post_request,
+            token_counter=OpenAITokenCounter.from_model(config.model.unwrap_or("")),
+        )
+
+    @staticmethod
+    def from_env(model: Optional[str] = None) -> "PooledOpenAILLM":
+        return PooledOpenAILLM(OpenAILLMConfiguration.from_env(model=model))
@@ -1,30 +1,3 @@
-import itertools
-import threading
-import time
-
-
-class Spinner:
-    def __init__(self, message="Working..."):
-        self.spinner_cycle = itertools.cycle(['-', '/', '|', '\\'])
-        self.running = False
-        self.spinner_thread = threading.Thread(target=self.init_spinner, args=(message,))
-
-    def start(self):
-        self.running = True
-        self.spinner_thread.start()
-
-    def stop(self):
-        self.running = False
-        self.spinner_thread.join()
-
-    def init_spinner(self, message):
-        while self.running:
-            print(f'\r{message} {next(self.spinner_cycle)}', end='', flush=True)
-            time.sleep(0.1)
-        # clear spinner from console
-        print('\r', end='', flush=True)
-
-
 import logging
 
 logging.basicConfig(
@@ -37,24 +10,26 @@ from council.contexts import AgentContext, Budget, ChatHistory
 from council.agents import Agent
 from council.chains import Chain
 from council.llm.openai_llm_configuration import OpenAILLMConfiguration
-from council.llm.openai_llm import OpenAILLM
 from council.runners.errrors import RunnerTimeoutError
 
 from skills import SectionWriterSkill, OutlineWriterSkill
 from controller import WritingAssistantController
 from filter import WritingAssistantFilter
 from evaluator import BasicEvaluatorWithSource
+from llm_cache import LLMResponseCache
+from pooled_llm import PooledOpenAILLM
 
 import os
 import dotenv
 dotenv.load_dotenv()
-openai_llm = OpenAILLM(config=OpenAILLMConfiguration.from_env())
+openai_llm = PooledOpenAILLM(config=OpenAILLMConfiguration.from_env())
 budget = float(os.getenv('BUDGET'))
+llm_cache = LLMResponseCache(os.getenv('LLM_CACHE_DIR'))
 
 # Create Skills
 
-outline_skill = OutlineWriterSkill(openai_llm)
-writing_skill = SectionWriterSkill(openai_llm)
+outline_skill = OutlineWriterSkill(openai_llm, cache=llm_cache)
+writing_skill = SectionWriterSkill(openai_llm, cache=llm_cache)
 
 # Create Chains
 
@@ -75,14 +50,17 @@ writer_chain = Chain(
 controller = WritingAssistantController(
     openai_llm,
     [outline_chain, writer_chain],
-    top_k_execution_plan=3
+    top_k_execution_plan=3,
+    cache=llm_cache
 )
 
 # Create Filter
 
 filter = WritingAssistantFilter(
     openai_llm,
-    controller.state
+    controller.state,
+    cache=llm_cache,
+    checkpoint_path=os.getenv('CHECKPOINT_PATH')
 )
 
 # Initialize Agent
@@ -102,17 +80,14 @@ def main():
             if user_input == '':
                 user_input = "Tell me about the history of box manufacturing."
 
-            s = Spinner()
-            s.start()
+            print("Working...")
             chat_history.add_user_message(user_input)
             run_context = AgentContext.from_chat_history(chat_history, Budget(budget))
             
             try:
                 result = agent.execute(run_context)
-                s.stop()
                 print(f"\n```markdown\n{result.messages[-1].message.message}\n```\n")
             except RunnerTimeoutError:
-                s.stop()
                 print("Execution stopped due to exceeded budget. Please consider increase the budget for future runs")
                 print("Intermediate results: \n")
                 print("Outline: ")
@@ -2,21 +2,20 @@ from council.skills import SkillBase
 from council.contexts import ChatMessage, SkillContext, LLMContext
 from council.llm import LLMBase, LLMMessage
 
-from string import Template
+import hashlib
+from typing import Optional
+
+from llm_cache import LLMResponseCache
+from utils import HistoryFormatter
 
 
 class OutlineWriterSkill(SkillBase):
     """Write or revise the outline of an article."""
 
-    def __init__(self, llm: LLMBase):
-        """Build a new OutlineWriterSkill."""
-
-        super().__init__(name="OutlineWriterSkill")
-        self.llm = self.new_monitor("llm", llm)
-
-        self.system_prompt = "You are an expert research writer and editor. Your role is to create and refine the outlines of research articles in markdown format."
+    system_prompt = "You are an expert research writer and editor. Your role is to create and refine the outlines of research articles in markdown format."
 
-        self.main_prompt_template = Template("""
+    # Static task description and example, sent as its own message so that it is a stable, cacheable prompt prefix
+    task_prompt = """
         # Task Description
         Your task is to write or revise the outline of a research article.
         First consider the CONVERSATION HISTORY and ARTICLE OUTLINE.
@@ -28,7 +27,7 @@ class OutlineWriterSkill(SkillBase):
         ## BEGIN EXAMPLE ##
 
         ## CONVERSATION HISTORY
-        ['ChatMessageKind.User: Write a detailed research article about the history of video games.']
+        USER: Write a detailed research article about the history of video games.
 
         ## ARTICLE OUTLINE
 
@@ -64,62 +63,76 @@ class OutlineWriterSkill(SkillBase):
         ```
         
         ## END EXAMPLE ##
+        """
 
+    main_prompt_template = """
         ## CONVERSATION HISTORY
-        $conversation_history
+        {conversation_history}
 
         ## ARTICLE OUTLINE
-        $article_outline
+        {article_outline}
 
         ## INSTRUCTIONS
-        $instructions
+        {instructions}
 
         ## NEW OR IMPROVED OUTLINE
         ```markdown
-        """)
+        """
+
+    def __init__(self, llm: LLMBase, temperature: float = 0.1, cache: Optional[LLMResponseCache] = None):
+        """
+        Build a new OutlineWriterSkill.
+
+        Parameters:
+            llm (LLMBase): the instance of LLM to use
+            temperature (float): the sampling temperature, responses are only cached at temperature 0
+            cache (Optional[LLMResponseCache]): an optional cache of LLM responses
+        """
+
+        super().__init__(name="OutlineWriterSkill")
+        self.llm = self.new_monitor("llm", llm)
+        self._temperature = temperature
+        self._cache = cache or LLMResponseCache()
+        self._history = HistoryFormatter()
 
     def execute(self, context: SkillContext) -> ChatMessage:
         """Execute `OutlineWriterSkill`."""
 
-        # Get the chat message history
-        chat_message_history = [
-            f"{m.kind}: {m.message}" for m in context.messages
-        ]
-
-        # Get the article
-        article = context.last_message.data['article']
+        # Shared by all execution units of the iteration, read-only
+        data = context.last_message.data
 
-        # Get the outline
-        outline = context.last_message.data['outline']
+        # Get the chat message history, as rendered once per iteration by the controller if available
+        # an empty history is a legitimate value, e.g. with max_history_turns=0
+        chat_message_history = (
+            data['conversation_history'] if 'conversation_history' in data
+            else self._history.format(list(context.messages))
+        )
 
-        # Get the iteration
-        iteration = context.last_message.data['iteration']
+        # Get the outline and the iteration
+        outline, iteration = data['outline'], data['iteration']
 
         # Get the instructions
         instructions = context.last_message.message
         
-        main_prompt = self.main_prompt_template.substitute(
+        main_prompt = self.main_prompt_template.format(
             conversation_history=chat_message_history,
-            article=article,
             article_outline=outline,
             instructions=instructions
         )
 
         messages_to_llm = [
             LLMMessage.system_message(self.system_prompt),
-            LLMMessage.assistant_message(
-                main_prompt
-            ),
+            LLMMessage.user_message(self.task_prompt),
+            LLMMessage.user_message(main_prompt),
         ]
 
-        llm_result = self.llm.inner.post_chat_request(
-            context=LLMContext.from_context(context, self.llm),
-            messages=messages_to_llm,
-            temperature=0.1
+        llm_response = self._cache.post_chat_request(
+            self.llm,
+            LLMContext.from_context(context, self.llm),
+            messages_to_llm,
+            temperature=self._temperature,
         )
 
-        llm_response = llm_result.first_choice
-
         return ChatMessage.skill(
             source=self.name,
             message="I've edited the outline and placed the response in the 'data' field.",
@@ -130,83 +143,108 @@ class OutlineWriterSkill(SkillBase):
 class SectionWriterSkill(SkillBase):
     """Write a specific section of an article."""
 
-    def __init__(self, llm: LLMBase):
-        """Build a new SectionWriterSkill."""
-
-        super().__init__(name="SectionWriterSkill")
-        self.llm = self.new_monitor("llm", llm)
-
-        self.system_prompt = "You are an expert research writer and editor. Your role is to write or revise detailed sections of research articles in markdown format."
+    system_prompt = "You are an expert research writer and editor. Your role is to write or revise detailed sections of research articles in markdown format."
 
-        self.main_prompt_template = Template("""
+    # Static task description, sent as its own message so that it is a stable, cacheable prompt prefix
+    task_prompt = """
         # Task Description
         Your task is to write specific sections of research articles using your own knowledge.
         First consider the CONVERSATION HISTORY, ARTICLE OUTLINE, ARTICLE, and INSTRUCTIONS.
         Then revise the article according to the context and INSTRUCTIONS provided below.
         All headings, sections, and subsections must consist of at least three detailed paragraphs each.
-        The entire REVISED ARTICLE should be written using markdown formatting. 
-
-        ## CONVERSATION HISTORY
-        $conversation_history
+        The entire REVISED ARTICLE should be written using markdown formatting.
+        """
 
+    # The article and its outline, shared by all the execution units of an iteration
+    document_template = """
         ## ARTICLE OUTLINE
-        $outline
+        {outline}
 
         ## ARTICLE
-        $article
+        {article}
+        """
+
+    main_prompt_template = """
+        ## CONVERSATION HISTORY
+        {conversation_history}
 
         ## INSTRUCTIONS
-        $instructions
+        {instructions}
 
         ## REVISED ARTICLE
         ```markdown
-        """)
+        """
+
+    def __init__(self, llm: LLMBase, temperature: float = 0.1, cache: Optional[LLMResponseCache] = None):
+        """
+        Build a new SectionWriterSkill.
+
+        Parameters:
+            llm (LLMBase): the instance of LLM to use
+            temperature (float): the sampling temperature, responses are only cached at temperature 0
+            cache (Optional[LLMResponseCache]): an optional cache of LLM responses
+        """
+
+        super().__init__(name="SectionWriterSkill")
+        self.llm = self.new_monitor("llm", llm)
+        self._temperature = temperature
+        self._cache = cache or LLMResponseCache()
+        self._history = HistoryFormatter()
+        self._document_key: Optional[bytes] = None
+        self._document_message: Optional[LLMMessage] = None
 
     def execute(self, context: SkillContext) -> ChatMessage:
         """Execute `SectionWriterSkill`."""
 
-        # Get the chat message history
-        conversation_history = [
-            f"{m.kind}: {m.message}" for m in context.messages
-        ]
+        # Shared by all execution units of the iteration, read-only
+        data = context.last_message.data
 
-        # Get the article
-        article = context.last_message.data['article']
-        
-        # Get the outline
-        outline = context.last_message.data['outline']
+        # Get the chat message history, as rendered once per iteration by the controller if available
+        # an empty history is a legitimate value, e.g. with max_history_turns=0
+        conversation_history = (
+            data['conversation_history'] if 'conversation_history' in data
+            else self._history.format(list(context.messages))
+        )
 
-        # Get the iteration
-        iteration = context.last_message.data['iteration']
+        # Get the article, the outline and the iteration
+        article, outline, iteration = data['article'], data['outline'], data['iteration']
        
         # Get the instructions
         instructions = context.last_message.message
         
-        main_prompt = self.main_prompt_template.substitute(
+        main_prompt = self.main_prompt_template.format(
             conversation_history=conversation_history,
-            outline=outline,
-            article=article,
             instructions=instructions
         )
 
         messages_to_llm = [
             LLMMessage.system_message(self.system_prompt),
-            LLMMessage.assistant_message(
-                main_prompt
-            ),
+            LLMMessage.user_message(self.task_prompt),
+            self._document(article, outline),
+            LLMMessage.user_message(main_prompt),
         ]
 
-        llm_result = self.llm.inner.post_chat_request(
-            context=LLMContext.from_context(context, self.llm),
-            messages=messages_to_llm,
-            temperature=0.1
-
+        llm_response = self._cache.post_chat_request(
+            self.llm,
+            LLMContext.from_context(context, self.llm),
+            messages_to_llm,
+            temperature=self._temperature,
         )
-        llm_response = llm_result.first_choice
 
         return ChatMessage.skill(
             source=self.name,
             message="I've written or edited the article and placed it in the 'data' field.",
             data={'article': llm_response, 'instructions': instructions, 'iteration': iteration},
         )
-    
\ No newline at end of file
+
+    def _document(self, article: str, outline: str) -> LLMMessage:
+        """
+        The article and outline message, rendered again only when their content changes.
+        """
+        key = hashlib.blake2b(article.encode() + b"\x1f" + outline.encode(), digest_size=16).digest()
+        if key != self._document_key:
+            self._document_message = LLMMessage.user_message(
+                self.document_template.format(outline=outline, article=article)
+            )
+            self._document_key = key
+        return self._document_message
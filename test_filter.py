@@ -0,0 +1,168 @@
+import importlib.util
+import unittest
+
+if importlib.util.find_spec("council") is not None:
+    from filter import (
+        _deduplicate,
+        _expand_chunks,
+        _expand_paragraphs,
+        _fails_check_list,
+        _mark_chunks,
+        _reference_chunks,
+        _reference_paragraphs,
+        _split_cdc,
+    )
+
+
+def _article(headers, paragraphs=3):
+    paragraph = " ".join(["word"] * 200)
+    sections = ["\n\n".join([header] + [paragraph] * paragraphs) for header in headers]
+    return "\n\n".join(sections)
+
+
+def _paragraphs(start, count):
+    return ["Paragraph " + " ".join(f"w{i}x{j}" for j in range(40)) for i in range(start, start + count)]
+
+
+@unittest.skipIf(importlib.util.find_spec("council") is None, "council is not installed")
+class TestFailsCheckList(unittest.TestCase):
+    def test_complete_article_passes(self):
+        headers = ["# Introduction", "# History", "# Conclusion"]
+        self.assertFalse(_fails_check_list(_article(headers), "\n".join(headers)))
+
+    def test_short_section_fails(self):
+        article = _article(["# Introduction", "# History", "# Impact"]) + "\n\n# Conclusion\n\n" + "word " * 10
+        self.assertTrue(_fails_check_list(article, "# Introduction\n# History\n# Impact\n# Conclusion"))
+
+    def test_paragraph_right_below_header_counts(self):
+        headers = ["# Introduction", "# History", "# Conclusion"]
+        article = _article(headers).replace("# History\n\n", "# History\n")
+        self.assertFalse(_fails_check_list(article, "\n".join(headers)))
+
+    def test_consecutive_headers(self):
+        article = _article(["# Introduction", "# History", "# Conclusion"]).replace("# History", "# History\n## Origins")
+        self.assertFalse(_fails_check_list(article, "# History\n## Origins"))
+
+    def test_numbered_outline_headers_match(self):
+        article = _article(["# Introduction", "# History", "# Conclusion"])
+        self.assertFalse(_fails_check_list(article, "# 1. Introduction\n# 2. History\n# 3 Conclusion"))
+
+    def test_missing_outline_header_fails(self):
+        article = _article(["# Introduction", "# History", "# Conclusion"])
+        self.assertTrue(_fails_check_list(article, "# Introduction\n# Impact on Society"))
+
+    def test_placeholder_fails(self):
+        article = _article(["# Introduction", "# History", "# Conclusion"]) + " [insert citation]"
+        self.assertTrue(_fails_check_list(article, "# Introduction"))
+
+    def test_bracketed_words_are_not_placeholders(self):
+        article = _article(["# Introduction", "# History", "# Conclusion"]) + " [additional reading]"
+        self.assertFalse(_fails_check_list(article, "# Introduction"))
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+@unittest.skipIf(importlib.util.find_spec("council") is None, "council is not installed")
+class TestDeduplicate(unittest.TestCase):
+    reference = "\n\n".join(_paragraphs(0, 5))
+
+    def test_exact_duplicates_are_removed(self):
+        edit = self.reference + "\n\n" + _paragraphs(5, 1)[0]
+        self.assertEqual(_deduplicate([edit, edit], self.reference), [edit])
+
+    def test_same_edit_is_removed(self):
+        new = _paragraphs(5, 1)[0]
+        edit = self.reference + "\n\n" + new
+        same_edit = self.reference + "\n\n" + new + "."
+        self.assertEqual(_deduplicate([edit, same_edit], self.reference), [edit])
+
+    def test_removals_are_kept(self):
+        paragraphs = _paragraphs(0, 5)
+        drop_last = "\n\n".join(paragraphs[:4])
+        drop_last_three = "\n\n".join(paragraphs[:2])
+        self.assertEqual(_deduplicate([drop_last, drop_last_three], self.reference), [drop_last, drop_last_three])
+
+    def test_larger_edit_is_kept(self):
+        new, extra = _paragraphs(5, 1)[0], "A short closing remark."
+        edit = self.reference + "\n\n" + new
+        larger_edit = edit + "\n\n" + extra
+        self.assertEqual(_deduplicate([edit, larger_edit], self.reference), [edit, larger_edit])
+
+    def test_different_edits_are_kept(self):
+        first = self.reference + "\n\n" + _paragraphs(5, 1)[0]
+        second = self.reference + "\n\n" + _paragraphs(6, 1)[0]
+        self.assertEqual(_deduplicate([first, second], self.reference), [first, second])
+
+
+def _markdown(sections):
+    return "\n\n".join(f"# Section {i}\n\n" + "\n\n".join(_paragraphs(10 * i, 3)) for i in range(sections)) + "\n"
+
+
+@unittest.skipIf(importlib.util.find_spec("council") is None, "council is not installed")
+class TestChunkReferences(unittest.TestCase):
+    article = _markdown(4)
+
+    def _chunks(self):
+        return {key: text for key, text in _split_cdc(self.article) if text.strip()}
+
+    def test_split_is_lossless(self):
+        self.assertEqual("\n".join(chunk for _, chunk in _split_cdc(self.article)), self.article)
+
+    def test_unchanged_article_round_trip(self):
+        chunks = self._chunks()
+        referenced = _reference_chunks(self.article, chunks)
+        self.assertIn("[UNCHANGED CHUNK #", referenced)
+        self.assertLess(len(referenced), len(self.article))
+        self.assertEqual(_expand_chunks(referenced, chunks), self.article)
+
+    def test_edited_article_round_trip(self):
+        chunks = self._chunks()
+        edited = self.article.replace(_paragraphs(10, 1)[0], "A rewritten paragraph about section one.")
+        self.assertEqual(_expand_chunks(_reference_chunks(edited, chunks), chunks), edited)
+
+    def test_markers_are_removed(self):
+        marked = _mark_chunks(self.article)
+        self.assertIn("<!-- chunk #", marked)
+        self.assertEqual(_expand_chunks(marked, self._chunks()), self.article)
+
+    def test_unknown_reference_is_dropped(self):
+        text = "# Section\n\n[UNCHANGED CHUNK #deadbeef]\n\nText."
+        self.assertEqual(_expand_chunks(text, self._chunks()), "# Section\n\n\n\nText.")
+
+
+@unittest.skipIf(importlib.util.find_spec("council") is None, "council is not installed")
+class TestParagraphReferences(unittest.TestCase):
+    def test_repeated_paragraphs_round_trip(self):
+        first = "\n\n".join(["# Title"] + _paragraphs(0, 3))
+        second = "\n\n".join(["# Title"] + _paragraphs(0, 2) + _paragraphs(5, 1))
+        (first_referenced, second_referenced), paragraphs = _reference_paragraphs([first, second])
+
+        self.assertEqual(len(paragraphs), 2)
+        self.assertIn("<!-- paragraph #", first_referenced)
+        self.assertEqual(second_referenced.count("[SEE PARAGRAPH #"), 2)
+        self.assertEqual(_expand_paragraphs(first_referenced, paragraphs), first)
+        self.assertEqual(_expand_paragraphs(second_referenced, paragraphs), second)
+
+    def test_short_paragraphs_are_repeated(self):
+        texts = ["# Title\n\nShort.", "# Title\n\nShort."]
+        self.assertEqual(_reference_paragraphs(texts), (texts, {}))
+
+    def test_unknown_reference_is_dropped(self):
+        self.assertEqual(_expand_paragraphs("A\n\n[SEE PARAGRAPH #0123456789abcdef ABOVE]", {}), "A\n\n")
+
+    def test_paragraph_references_expand_before_chunk_references(self):
+        existing = _markdown(4)
+        new = _paragraphs(50, 1)[0]
+        first = existing + "\n" + new + "\n"
+        second = existing + "\n" + new + "\n\nAnother closing paragraph.\n"
+
+        chunks = {key: text for key, text in _split_cdc(existing) if text.strip()}
+        referenced = [_reference_chunks(text, chunks) for text in (first, second)]
+        referenced, paragraphs = _reference_paragraphs(referenced)
+
+        # repeated runs of chunk references are themselves referenced as paragraphs
+        self.assertTrue(any("[UNCHANGED CHUNK #" in paragraph for paragraph in paragraphs.values()))
+        for original, text in zip((first, second), referenced):
+            self.assertEqual(_expand_chunks(_expand_paragraphs(text, paragraphs), chunks), original)
@@ -0,0 +1,103 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+
+if importlib.util.find_spec("council") is not None:
+    from council.llm import LLMMessage
+
+    from llm_cache import LLMResponseCache
+
+
+class _FakeResult:
+    def __init__(self, first_choice):
+        self.first_choice = first_choice
+
+
+class _FakeConfig:
+    def __init__(self, model, temperature):
+        self.model = model
+        self.temperature = temperature
+
+    def build_default_payload(self):
+        return {"model": self.model, "temperature": self.temperature}
+
+
+class _FakeLLM:
+    """An LLM answering with a numbered response, counting its calls."""
+
+    def __init__(self, model="gpt-4", temperature=0.0):
+        self.config = _FakeConfig(model, temperature)
+        self.calls = 0
+
+    def post_chat_request(self, context, messages, **kwargs):
+        self.calls += 1
+        return _FakeResult(f"response {self.calls}")
+
+
+class _FakeMonitored:
+    def __init__(self, inner):
+        self.inner = inner
+
+
+@unittest.skipIf(importlib.util.find_spec("council") is None, "council is not installed")
+class TestLLMResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.llm = _FakeLLM()
+        self.monitored = _FakeMonitored(self.llm)
+
+    def _post(self, cache, content="Hello", monitored=None, **kwargs):
+        messages = [LLMMessage.user_message(content)]
+        return cache.post_chat_request(monitored or self.monitored, None, messages, **kwargs)
+
+    def test_hit(self):
+        cache = LLMResponseCache()
+        self.assertEqual(self._post(cache), "response 1")
+        self.assertEqual(self._post(cache), "response 1")
+        self.assertEqual(self.llm.calls, 1)
+
+    def test_key_includes_messages_kwargs_and_model(self):
+        cache = LLMResponseCache()
+        self._post(cache)
+        self._post(cache, content="Goodbye")
+        self._post(cache, max_tokens=100)
+        other_model = _FakeLLM(model="gpt-3.5-turbo")
+        self._post(cache, monitored=_FakeMonitored(other_model))
+        self.assertEqual(self.llm.calls, 3)
+        self.assertEqual(other_model.calls, 1)
+
+    def test_sampled_requests_bypass_the_cache(self):
+        cache = LLMResponseCache()
+        self._post(cache, temperature=0.1)
+        self._post(cache, temperature=0.1)
+        self.assertEqual(self.llm.calls, 2)
+
+        sampling = _FakeLLM(temperature=0.5)
+        self._post(cache, monitored=_FakeMonitored(sampling))
+        self._post(cache, monitored=_FakeMonitored(sampling))
+        self.assertEqual(sampling.calls, 2)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = LLMResponseCache(maxsize=2)
+        self._post(cache, content="a")
+        self._post(cache, content="b")
+        self._post(cache, content="a")
+        self._post(cache, content="c")
+        self.assertEqual(self.llm.calls, 3)
+
+        self._post(cache, content="a")
+        self.assertEqual(self.llm.calls, 3)
+        self._post(cache, content="b")
+        self.assertEqual(self.llm.calls, 4)
+
+    def test_disk_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertEqual(self._post(LLMResponseCache(directory)), "response 1")
+            self.assertEqual(len(os.listdir(directory)), 1)
+
+            self.assertEqual(self._post(LLMResponseCache(directory)), "response 1")
+            self.assertEqual(self.llm.calls, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
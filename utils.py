@@ -0,0 +1,69 @@
+from council.contexts import ChatMessage
+
+import contextlib
+import os
+import tempfile
+from typing import Iterable, List, Optional, Sequence
+
+
+def format_message(message: ChatMessage) -> str:
+    """Format a chat message as a single prompt line."""
+    return f"{message.kind}: {message.message}"
+
+
+def format_history(messages: Iterable[ChatMessage]) -> str:
+    """
+    Format chat messages for a prompt, one message per line.
+
+    Returns a single string: substituting a list into a prompt template would render its repr,
+    brackets and quotes included.
+    """
+    return "\n".join(format_message(m) for m in messages)
+
+
+class HistoryFormatter:
+    """
+    Format chat messages like `format_history`, keeping the formatted lines between calls.
+
+    Only the messages that were not part of the previous call are formatted: appended messages
+    when the history grows, or the messages after the common prefix when it changes.
+    """
+
+    def __init__(self):
+        self._messages: List[ChatMessage] = []
+        self._lines: List[str] = []
+
+    def format(self, messages: Sequence[ChatMessage], max_turns: Optional[int] = None) -> str:
+        """
+        Format `messages`, or only the `max_turns` most recent ones, one message per line.
+        """
+        known = min(len(self._messages), len(messages))
+        if known > 0 and messages[known - 1] is not self._messages[known - 1]:
+            # not the messages seen so far, keep their common prefix only
+            known = next(i for i in range(known) if messages[i] is not self._messages[i])
+        del self._messages[known:]
+        del self._lines[known:]
+
+        self._messages.extend(messages[known:])
+        self._lines.extend(format_message(m) for m in messages[known:])
+        # not a negative slice: [-0:] would keep every line
+        lines = self._lines if max_turns is None else self._lines[max(len(self._lines) - max_turns, 0):]
+        return "\n".join(lines)
+
+
+def write_atomically(path: str, text: str) -> None:
+    """
+    Write `text` to the file at `path` through a temporary file renamed over it,
+    so that readers never see a partially written file.
+
+    On failure, the temporary file is removed and the error is raised.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise